@@ -1,70 +1,197 @@
 import plotly.express as px
+import plotly.io as pio
 import pandas as pd
+import numpy as np
 import os
-import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+import orjson
+import connectorx as cx
+from psycopg_pool import ConnectionPool
 from dash import Dash, html, dcc, callback, Output, Input
+from flask_caching import Cache
 
 app=Dash(__name__,
          title="Bribe Analytics",
         )
-
-# Initialize psycopg2 connection pool
+# WSGI entry point for gunicorn: `gunicorn graph:server`
+server = app.server
+
+# Query results and serialized figures are cached on disk so every worker process
+# shares them; the data is append-mostly, so an hour of caching is fine.
+# A figure can be built from query results that are already DASHBOARD_DATA_TIMEOUT
+# old, so the figure cache keeps the rest of the hour: caching adds at most
+# CACHE_TIMEOUT to a chart's age. The state/department/district charts read
+# mv_bribe_rollup, so on top of that they are as stale as its last REFRESH (nightly).
+CACHE_TIMEOUT = 3600
+DASHBOARD_DATA_TIMEOUT = 300
+FIGURE_TIMEOUT = CACHE_TIMEOUT - DASHBOARD_DATA_TIMEOUT
+cache = Cache(app.server, config={
+    "CACHE_TYPE": "FileSystemCache",
+    "CACHE_DIR": "/tmp/bribe-cache",
+    "CACHE_DEFAULT_TIMEOUT": CACHE_TIMEOUT,
+})
+
+# Initialize psycopg connection pool
+# Dash serves callbacks from several threads, so the pool has to be thread-safe
 dsn = os.environ.get("DB_URL")
-connection_pool = psycopg2.pool.SimpleConnectionPool(minconn=1, maxconn=15, dsn=dsn)
-
-def get_data_as_dataframe(query, params=None):
-    """Executes raw SQL and returns a Pandas DataFrame."""
-    conn = None
-    try:
-        conn = connection_pool.getconn()
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, params or ())
-            rows = cur.fetchall()
-            if not rows:
-                return pd.DataFrame()
-            # rows are list of dicts, so columns auto-mapped
-            return pd.DataFrame(rows)
-    finally:
-        if conn:
-            connection_pool.putconn(conn)
+connection_pool = ConnectionPool(dsn, min_size=8, max_size=25, open=True)
+# The pool connects in the background; block until min_size connections are up so
+# the first requests, one per server thread, don't pay the connect latency
+connection_pool.wait(timeout=30)
+
+# The state/department/district charts read mv_bribe_rollup, and a missing view would
+# fail the whole dashboard batch, so refuse to start without it
+with connection_pool.connection() as conn:
+    if conn.execute("SELECT to_regclass('mv_bribe_rollup')").fetchone()[0] is None:
+        raise RuntimeError(
+            "Materialized view mv_bribe_rollup does not exist. Create it with "
+            "`psql \"$DB_URL\" -f sql/mv_bribe_rollup.sql` and refresh it nightly (see README.md)."
+        )
 
-def plot_bribe_amount_distribution():
-    #Generates an interactive histogram of bribe amounts
-    sql = "SELECT bribe_amt FROM bribe;"
-    df = get_data_as_dataframe(sql)
+# Set BUCKET_PUSHDOWN=0 to bucket bribe amounts in pandas instead of in PostgreSQL
+BUCKET_PUSHDOWN = os.environ.get("BUCKET_PUSHDOWN", "1") != "0"
+
+# Every chart uses the same template; setting it once here also loads it before the first request
+pio.templates.default = "plotly_white"
+# Dash serializes callback responses through plotly's JSON helpers too, so this
+# covers both pio.to_json and the payload sent to the browser
+pio.json.config.default_engine = "orjson"
+
+BIN_EDGES = np.array([0, 500, 1000, 1500, 2000, 3000, 5000, 10000, 20000, 30000, 40000, 50000, np.inf])
+# labels for the bins
+BIN_LABELS = [
+    '₹1-500', '₹501-1000', '₹1001-1500', '₹1501-2000', '₹2001-3000',
+    '₹3001-5000', '₹5001-10000', '₹10001-20000', '₹20001-30000',
+    '₹30001-40000', '₹40001-50000', '>₹50000'
+]
+# float32 copy of BIN_EDGES for bucketing float32 amounts without upcasting them;
+# every edge, inf included, is exact in float32
+BIN_EDGES_F32 = BIN_EDGES.astype(np.float32)
+# BIN_EDGES negated and reversed for the bucket query, see DASHBOARD_QUERIES
+BUCKET_THRESHOLDS = (-BIN_EDGES[-2::-1]).tolist()
+
+# The query behind each chart. load_dashboard_data() sends them all in one pipeline
+# and prepares them on the server, so repeat runs skip the parse/plan step.
+DASHBOARD_QUERIES = {
+    # width_bucket() includes the left edge, so it is run on the negated amount
+    # against the negated edges to keep the right edge inclusive (500 is in '₹1-500');
+    # the bucket number is then flipped to index BIN_LABELS directly.
+    "bucket": """
+        SELECT %(last_bucket)s - width_bucket(-bribe_amt::numeric, %(thresholds)s::numeric[]) AS bkt,
+               COUNT(*) AS n
+        FROM bribe
+        WHERE bribe_amt > 0
+        GROUP BY bkt
+        ORDER BY bkt
+    """,
+    # The state/dept/district totals read the mv_bribe_rollup view (sql/mv_bribe_rollup.sql).
+    # Each is capped so the result stays small however many states, departments
+    # or districts the data grows to; there are 36 states and UTs today.
+    "state": """
+        SELECT state_ut, SUM(total_amount) AS total_amount
+        FROM mv_bribe_rollup
+        GROUP BY state_ut
+        ORDER BY total_amount DESC
+        LIMIT 40
+    """,
+    "monthly": """
+        SELECT to_char(date_trunc('month', doi), 'YYYY-MM') AS month_year, COUNT(*) AS count
+        FROM bribe
+        WHERE doi IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+    """,
+    "dept": """
+        SELECT dept, SUM(total_amount) AS total_amount
+        FROM mv_bribe_rollup
+        WHERE dept IS NOT NULL
+        GROUP BY dept
+        ORDER BY total_amount DESC
+        LIMIT %(top_departments)s
+    """,
+    "district": """
+        SELECT district, SUM(total_amount) AS total_amount
+        FROM mv_bribe_rollup
+        WHERE district IS NOT NULL
+        GROUP BY district
+        ORDER BY total_amount DESC
+        LIMIT %(top_districts)s
+    """,
+}
 
-    if df.empty :
-        print("No data available for bribe amount distribution.")
-        return None #return an empty figure
+def read_sql_connectorx(query):
+    """Executes raw SQL through ConnectorX and returns a Pandas DataFrame.
 
-    bin_edges = [0, 500, 1000, 1500, 2000, 3000, 5000, 10000, 20000, 30000, 40000, 50000, float('inf')]
-    # labels for the bins
-    bin_labels = [
-        '₹1-500', '₹501-1000', '₹1001-1500', '₹1501-2000', '₹2001-3000',
-        '₹3001-5000', '₹5001-10000', '₹10001-20000', '₹20001-30000',
-        '₹30001-40000', '₹40001-50000', '>₹50000'
-    ]
+    ConnectorX decodes the result into column buffers without building Python rows,
+    which suits large full-column scans. It opens its own connection to DB_URL instead
+    of using connection_pool, and takes no bind parameters.
+    """
+    return cx.read_sql(dsn, query, return_type="pandas")
 
-    # Create a new column with the bin category for each bribe amount
-    # 'right=True' means bins include the right edge (e.g., 500 is in '₹1-500')
-    df['bribe_range'] = pd.cut(df['bribe_amt'], bins=bin_edges, labels=bin_labels, right=True)
+@cache.memoize(timeout=DASHBOARD_DATA_TIMEOUT)
+def load_dashboard_data(top_departments=15, top_districts=20, include_bucket=BUCKET_PUSHDOWN):
+    """Fetches the data behind every chart in one round trip and returns a DataFrame per chart.
 
-    # Count the frequency of reports in each bin
-    bribe_counts = df['bribe_range'].value_counts().reset_index()
-    bribe_counts.columns = ['Bribe Amount Range', 'Number of Reports']
+    include_bucket is an argument rather than a read of BUCKET_PUSHDOWN so that it is
+    part of the cache key; the cache is shared by every process, whatever their setting.
+    """
+    params = {
+        "last_bucket": len(BIN_LABELS) - 1,
+        "thresholds": BUCKET_THRESHOLDS,
+        "top_departments": top_departments,
+        "top_districts": top_districts,
+    }
+    queries = dict(DASHBOARD_QUERIES)
+    if not include_bucket:
+        # plot_bribe_amount_distribution() buckets the raw amounts itself
+        del queries["bucket"]
+    with connection_pool.connection() as conn, conn.pipeline():
+        # Every query is queued before any result is read
+        cursors = {name: conn.execute(sql, params, prepare=True) for name, sql in queries.items()}
+        # rows are plain tuples, so the column names come from the cursor description
+        return {
+            name: pd.DataFrame(cur.fetchall(), columns=[col.name for col in cur.description])
+            for name, cur in cursors.items()
+        }
 
-    # Ensure the categories are ordered correctly for the plot
-    bribe_counts['Bribe Amount Range'] = pd.Categorical(bribe_counts['Bribe Amount Range'], categories=bin_labels, ordered=True)
-    bribe_counts = bribe_counts.sort_values('Bribe Amount Range')
+def plot_bribe_amount_distribution():
+    #Generates an interactive histogram of bribe amounts
+    if BUCKET_PUSHDOWN:
+        # Bucketed on the server so only one row per range comes back
+        df = load_dashboard_data()["bucket"]
+
+        if df.empty :
+            print("No data available for bribe amount distribution.")
+            return None #return an empty figure
+
+        # Fill in ranges with no reports so every bin shows up in order
+        counts = df.set_index('bkt')['n'].reindex(range(len(BIN_LABELS)), fill_value=0)
+        bribe_counts = pd.DataFrame({'Bribe Amount Range': BIN_LABELS, 'Number of Reports': counts.to_numpy()})
+    else:
+        # real is exact for the bin edges and halves the bytes sent over the wire for the scan
+        sql = "SELECT bribe_amt::real FROM bribe WHERE bribe_amt IS NOT NULL"
+        df = read_sql_connectorx(sql)
+
+        if df.empty :
+            print("No data available for bribe amount distribution.")
+            return None #return an empty figure
+
+        # ConnectorX's pandas output has no float32, so the column arrives as float64.
+        # The float32 copy is searched against BIN_EDGES_F32, so numpy makes no
+        # further float64 copy of the scan.
+        amounts = df['bribe_amt'].to_numpy(dtype=np.float32)
+
+        # Bin index for each bribe amount; side='left' makes the bins include their
+        # right edge (e.g., 500 is in '₹1-500'), which np.histogram cannot do.
+        # Index 0 holds amounts <= 0, which fall outside every bin.
+        bins = np.searchsorted(BIN_EDGES_F32, amounts, side='left')
+        counts = np.bincount(bins, minlength=len(BIN_EDGES))[1:len(BIN_EDGES)]
+        bribe_counts = pd.DataFrame({'Bribe Amount Range': BIN_LABELS, 'Number of Reports': counts})
 
     fig = px.bar(bribe_counts,
                  x='Bribe Amount Range',
                  y='Number of Reports',
                  title="Distribution of Reported Bribe Amounts by Range",
-                 labels={'Bribe Amount Range': 'Bribe Amount (INR) Range'},
-                 template="plotly_white")
+                 labels={'Bribe Amount Range': 'Bribe Amount (INR) Range'})
     
     fig.update_layout(xaxis_tickangle=-45)
 
@@ -72,13 +199,7 @@ def plot_bribe_amount_distribution():
 
 def plot_total_bribe_amount_by_state():
     #Generates bar chart of total bribe amounts by state/UT.
-    sql = """
-        SELECT state_ut, SUM(bribe_amt) AS total_amount
-        FROM bribe
-        GROUP BY state_ut
-        ORDER BY total_amount DESC;
-    """
-    df = get_data_as_dataframe(sql)
+    df = load_dashboard_data()["state"]
 
     if df.empty or 'state_ut' not in df.columns or 'total_amount' not in df.columns:
         print("No data available for total bribe amount by state.")
@@ -86,51 +207,28 @@ def plot_total_bribe_amount_by_state():
 
     fig = px.bar(df, x="state_ut", y="total_amount",
                  title="Total Reported Bribe Amount by State/UT",
-                 labels={'state_ut': 'State/UT', 'total_amount': 'Total Bribe Amount (INR)'},
-                 template="plotly_white")
+                 labels={'state_ut': 'State/UT', 'total_amount': 'Total Bribe Amount (INR)'})
     fig.update_layout(xaxis_title="State/UT", yaxis_title="Total Amount (INR)")
     return fig
 
 def plot_bribes_over_time():
     #Generates line chart of bribe reports over time (monthly).
-    sql = "SELECT doi FROM bribe WHERE doi IS NOT NULL;"
-    df = get_data_as_dataframe(sql)
+    df = load_dashboard_data()["monthly"]
 
-    if df.empty or 'doi' not in df.columns:
+    if df.empty or 'month_year' not in df.columns:
         print("No data with dates available for bribes over time.")
         return None
 
-    # Ensure 'doi' is datetime type and handle potential errors
-    df['doi'] = pd.to_datetime(df['doi'], errors='coerce')
-    df.dropna(subset=['doi'], inplace=True) # Drop rows where conversion failed
-
-    if df.empty:
-        print("No valid dates found after conversion.")
-        return None
-
-    # Aggregate by month
-    df['month_year'] = df['doi'].dt.to_period('M').astype(str) # Group by month-year string
-    monthly_counts = df.groupby('month_year').size().reset_index(name='count')
-    monthly_counts = monthly_counts.sort_values('month_year') # Ensure chronological order
-
-    fig = px.line(monthly_counts, x="month_year", y="count",
+    fig = px.line(df, x="month_year", y="count",
                   title="Number of Bribe Reports Over Time (Monthly)",
                   labels={'month_year': 'Month', 'count': 'Number of Reports'},
-                  markers=True,
-                  template="plotly_white")
+                  markers=True)
     fig.update_layout(xaxis_title="Month", yaxis_title="Number of Reports")
     return fig
 
 def plot_top_departments_by_bribe_amount(top_n=15):
     #Generates bar chart of top 15 departments by total bribe amount.
-    sql = """
-        SELECT dept, SUM(bribe_amt) AS total_amount
-        FROM bribe
-        GROUP BY dept
-        ORDER BY total_amount DESC
-        LIMIT %s;
-    """
-    df = get_data_as_dataframe(sql, (top_n,))
+    df = load_dashboard_data(top_departments=top_n)["dept"]
 
     if df.empty or 'dept' not in df.columns or 'total_amount' not in df.columns:
         print(f"No data available for top {top_n} departments by bribe amount.")
@@ -138,22 +236,14 @@ def plot_top_departments_by_bribe_amount(top_n=15):
 
     fig = px.bar(df, x="dept", y="total_amount",
                  title=f"Top {top_n} Departments by Total Reported Bribe Amount",
-                 labels={'dept': 'Department', 'total_amount': 'Total Bribe Amount (INR)'},
-                 template="plotly_white")
+                 labels={'dept': 'Department', 'total_amount': 'Total Bribe Amount (INR)'})
     fig.update_layout(xaxis_title="Department", yaxis_title="Total Amount (INR)")
     fig.update_xaxes(tickangle= -45)
     return fig
 
 def plot_top_districts_by_bribe_amount(top_n=20):
     #Generates  bar chart of top 20 districts by total bribe amount.
-    sql = """
-        SELECT district, SUM(bribe_amt) AS total_amount
-        FROM bribe
-        GROUP BY district
-        ORDER BY total_amount DESC
-        LIMIT %s;
-    """
-    df = get_data_as_dataframe(sql, (top_n,))
+    df = load_dashboard_data(top_districts=top_n)["district"]
 
     if df.empty or 'district' not in df.columns or 'total_amount' not in df.columns:
         print(f"No data available for top {top_n} districts by bribe amount.")
@@ -161,70 +251,76 @@ def plot_top_districts_by_bribe_amount(top_n=20):
 
     fig = px.bar(df, x="district", y="total_amount",
                  title=f"Top {top_n} Districts by Total Reported Bribe Amount",
-                 labels={'district': 'District', 'total_amount': 'Total Bribe Amount (INR)'},
-                 template="plotly_white")
+                 labels={'district': 'District', 'total_amount': 'Total Bribe Amount (INR)'})
     fig.update_layout(xaxis_title="District", yaxis_title="Total Amount (INR)")
     fig.update_xaxes(tickangle= -45)
     return fig
 
-if __name__ == "__main__":
-
-    app.layout = html.Div(
-            children=[
-                html.Div(
-                    children=[
-                        html.Label("Graphs: "),
-                        html.Div(
-                            children=[
-                                dcc.Dropdown(
-                                    [
-                                    "Bribe distribution",
-                                    "State wise Bribe data",
-                                    "Top 15 Departments",
-                                    "Top 20 Districts",
-                                    "Bribes over time",
-                                ],
+app.layout = html.Div(
+        children=[
+            html.Div(
+                children=[
+                    html.Label("Graphs: "),
+                    html.Div(
+                        children=[
+                            dcc.Dropdown(
+                                [
                                 "Bribe distribution",
-                                    id="dropdown",
-                                )
+                                "State wise Bribe data",
+                                "Top 15 Departments",
+                                "Top 20 Districts",
+                                "Bribes over time",
                             ],
-                            style={"width": "20%", "margin-left": "5px"},
-                        ),
-                    ],
-                    style={
-                        "display": "flex",
-                        "justifyContent": "center",
-                        "alignItems": "center",
-                    },
-                ),
-                dcc.Graph(figure={}, id="graph"),
-            ]
-        )
-
-    @callback(
-        Output(component_id="graph", component_property="figure"),
-        Input(component_id="dropdown", component_property="value"),
+                            "Bribe distribution",
+                                id="dropdown",
+                            )
+                        ],
+                        style={"width": "20%", "margin-left": "5px"},
+                    ),
+                ],
+                style={
+                    "display": "flex",
+                    "justifyContent": "center",
+                    "alignItems": "center",
+                },
+            ),
+            dcc.Graph(figure={}, id="graph"),
+        ]
     )
-    def update_graph(value):
-        fig = None
-        if value == "Bribe distribution":
-            fig = plot_bribe_amount_distribution()
 
-        elif value == "State wise Bribe data":
-            fig = plot_total_bribe_amount_by_state()
+@cache.memoize(timeout=FIGURE_TIMEOUT)
+def get_figure_json(value):
+    # Builds the figure for a dropdown value and caches it already serialized,
+    # so repeat requests skip both the queries and plotly's figure serialization
+    fig = None
+    if value == "Bribe distribution":
+        fig = plot_bribe_amount_distribution()
 
-        elif value == "Top 15 Departments":
-            fig = plot_top_departments_by_bribe_amount()
+    elif value == "State wise Bribe data":
+        fig = plot_total_bribe_amount_by_state()
 
-        elif value == "Top 20 Districts":
-            fig = plot_top_districts_by_bribe_amount()
+    elif value == "Top 15 Departments":
+        fig = plot_top_departments_by_bribe_amount()
 
-        elif value == "Bribes over time":
-            fig = plot_bribes_over_time()
+    elif value == "Top 20 Districts":
+        fig = plot_top_districts_by_bribe_amount()
 
-        # Return an empty figure if no data is found
-        return fig if fig is not None else {}
-    
+    elif value == "Bribes over time":
+        fig = plot_bribes_over_time()
+
+    return pio.to_json(fig) if fig is not None else None
+
+@callback(
+    Output(component_id="graph", component_property="figure"),
+    Input(component_id="dropdown", component_property="value"),
+)
+def update_graph(value):
+    fig_json = get_figure_json(value)
+    # Return an empty figure if no data is found
+    return orjson.loads(fig_json) if fig_json is not None else {}
+
+if __name__ == "__main__":
+    # Local development only; production runs under gunicorn (see gunicorn.conf.py)
     port = int(os.environ.get("PORT", 10000))  # fallback to 10000 if PORT is unset
     app.run(host="0.0.0.0", port=port)
     #app.run(debug=True)
@@ -0,0 +1,15 @@
+# Production server settings, picked up automatically by `gunicorn graph:server`
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# Separate processes let the pandas/plotly work run in parallel despite the GIL;
+# threads overlap the time each request spends waiting on the database.
+# Every worker opens its own connection pool, so keep max_size in graph.py >= threads.
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+worker_class = "gthread"
+threads = 8
+
+# Don't preload: the connection pool starts background threads at import, which must
+# happen in each worker rather than in the master before it forks.
+preload_app = False
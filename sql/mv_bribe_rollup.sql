@@ -0,0 +1,20 @@
+-- Pre-aggregated bribe totals per (state_ut, dept, district) for the state,
+-- department and district charts in graph.py, so they re-aggregate a few
+-- thousand rows instead of scanning the whole bribe table.
+--
+-- Create once:
+--   psql "$DB_URL" -f sql/mv_bribe_rollup.sql
+-- Refresh nightly (e.g. from cron):
+--   psql "$DB_URL" -c "REFRESH MATERIALIZED VIEW CONCURRENTLY mv_bribe_rollup;"
+--
+-- Only the finest grouping is stored; the charts SUM over it. A ROLLUP here would
+-- add subtotal rows that get counted again when the charts sum by one column.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_bribe_rollup AS
+SELECT state_ut, dept, district, SUM(bribe_amt) AS total_amount, COUNT(*) AS n
+FROM bribe
+GROUP BY state_ut, dept, district;
+
+-- REFRESH ... CONCURRENTLY needs a unique index on the view
+CREATE UNIQUE INDEX IF NOT EXISTS mv_bribe_rollup_key
+    ON mv_bribe_rollup (state_ut, dept, district);